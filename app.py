@@ -1,10 +1,162 @@
-from flask import Flask
+from flask import Flask, Response, abort, request
 app = Flask(__name__)
+import multiprocessing
 import os
-import sys
-import database
-import pickle
-import json
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import orjson
+
+import brain2
+
+# Solver processes are started on the first /json request and then kept
+# alive, so ortools is imported once per worker instead of once per request.
+# They come from a forkserver, as forking this multi-threaded server could copy
+# locks held by other threads. Each worker writes its own side-output files
+# to BRAIN_OUTPUT_DIR, outside the app directory.
+# If a worker dies (OOM kill, segfault) the pool is broken for good, so the
+# next submit replaces it.
+BRAIN_WORKERS = int(os.environ.get('BRAIN_WORKERS', 2))
+BRAIN_OUTPUT_DIR = os.environ.get(
+    'BRAIN_OUTPUT_DIR', os.path.join(tempfile.gettempdir(), 'brain2'))
+_brain_pool = None
+_brain_pool_lock = threading.Lock()
+
+
+def brain_pool():
+    global _brain_pool
+    with _brain_pool_lock:
+        if _brain_pool is None:
+            _brain_pool = ProcessPoolExecutor(
+                max_workers=BRAIN_WORKERS,
+                mp_context=multiprocessing.get_context('forkserver'),
+                initializer=brain2.init_worker,
+                initargs=(BRAIN_OUTPUT_DIR,))
+    return _brain_pool
+
+
+def submit_solve(fn, *args):
+    """Submits fn(*args) to the solver pool, replacing the pool once if it is broken."""
+    global _brain_pool
+    pool = brain_pool()
+    try:
+        return pool.submit(fn, *args)
+    except BrokenProcessPool:
+        with _brain_pool_lock:
+            if _brain_pool is pool:
+                _brain_pool = None
+            pool.shutdown(wait=False)
+        return brain_pool().submit(fn, *args)
+
+
+def parse_payload(request_data):
+    """
+    Returns the payload with its JSON-string fields decoded and None, or None
+    and an error message. Workers get the decoded payload, so they don't
+    parse the same strings again.
+    """
+    error = brain2.validate(request_data)
+    if error:
+        return None, error
+    try:
+        return brain2.decode_fields(request_data), None
+    except ValueError as e:
+        return None, str(e)
+
+
+def solve_json(request_data):
+    """Runs in a pool worker; returns the schedule already JSON-encoded."""
+    return orjson.dumps(brain2.run(request_data))
+
+
+# Background /json/jobs solves, keyed by job id. Each job keeps its latest
+# status event, so any number of /progress clients can read it; finished jobs
+# are dropped JOB_TTL seconds after they end.
+JOB_TTL = int(os.environ.get('JOB_TTL', 3600))
+jobs = {}
+jobs_lock = threading.Lock()
+
+# Workers report solver progress as (job id, event) pairs on a queue served by
+# a manager process, which forward_progress copies into jobs.
+_progress_queue = None
+_progress_queue_lock = threading.Lock()
+
+
+def progress_queue():
+    global _progress_queue
+    with _progress_queue_lock:
+        if _progress_queue is None:
+            manager = multiprocessing.get_context('forkserver').Manager()
+            _progress_queue = manager.Queue()
+            threading.Thread(target=forward_progress, args=(_progress_queue,),
+                             daemon=True).start()
+    return _progress_queue
+
+
+def forward_progress(events):
+    global _progress_queue
+    while True:
+        try:
+            jid, event = events.get()
+        except (EOFError, OSError):
+            # The manager process is gone; the next job starts a new one.
+            with _progress_queue_lock:
+                if _progress_queue is events:
+                    _progress_queue = None
+            return
+        with jobs_lock:
+            job = jobs.get(jid)
+        if job is not None:
+            update_job(job, event)
+
+
+def run_job(events, jid, request_data):
+    """Runs in a pool worker; reports the job's progress on events."""
+    def progress(event):
+        try:
+            events.put((jid, event))
+        except (EOFError, OSError):
+            pass  # Progress is best effort; the solve goes on.
+    return brain2.run(request_data, progress=progress)
+
+
+def update_job(job, event, finished=None):
+    """Sets the job's event and wakes its /progress streams; a finished job keeps its final event."""
+    with job['changed']:
+        if job['finished'] is None:
+            job['event'] = event
+            job['seq'] += 1
+            job['finished'] = finished
+            job['changed'].notify_all()
+
+
+def job_event(future):
+    try:
+        return {'status': 'done', 'result': future.result()}
+    except Exception as e:
+        return {'status': 'error', 'error': str(e)}
+
+
+def finish_job(job, future):
+    update_job(job, job_event(future), time.monotonic())
+
+
+def expire_jobs():
+    now = time.monotonic()
+    with jobs_lock:
+        expired = [jid for jid, job in jobs.items()
+                   if job['finished'] is not None and now - job['finished'] > JOB_TTL]
+        for jid in expired:
+            del jobs[jid]
+
+
+@app.errorhandler(BrokenProcessPool)
+def solver_died(e):
+    return {'error': 'a solver process died, please retry'}, 503
 
 @app.route("/")
 def hello():
@@ -14,19 +166,72 @@ def hello():
 def hej():
     return "Hej"
 
-@app.route('/json', methods=['POST'])
-def json():
-    
-    import json
-    data={}
-    with open('brain.json', 'w') as outfile:
-            json.dump(data, outfile)
-    request_data = request.get_json()
-    with open('data.json', 'w') as file:
-        json.dump(request_data ,file)
-    import os
-    os.system("python brain2.py")
-    with open('brain.json') as json_file:
-        data = json.load(json_file)
+@app.route('/json', methods=['POST'], endpoint='json')
+def handle_json():
+    request_data, error = parse_payload(request.get_json(silent=True))
+    if error:
+        return {'error': error}, 400
+    body = submit_solve(solve_json, request_data).result()
     #return request_data
-    return data
+    return app.response_class(body, mimetype='application/json')
+
+@app.route('/json/batch', methods=['POST'])
+def json_batch():
+    batch = request.get_json(silent=True)
+    if not isinstance(batch, list):
+        return {'error': 'payload must be a JSON array'}, 400
+    for i, request_data in enumerate(batch):
+        batch[i], error = parse_payload(request_data)
+        if error:
+            return {'error': 'job %i: %s' % (i, error)}, 400
+    futures = [submit_solve(solve_json, request_data) for request_data in batch]
+    bodies = [future.result() for future in futures]
+    return app.response_class(b'[' + b','.join(bodies) + b']',
+                              mimetype='application/json')
+
+@app.route('/json/jobs', methods=['POST'])
+def json_job():
+    request_data, error = parse_payload(request.get_json(silent=True))
+    if error:
+        return {'error': error}, 400
+    expire_jobs()
+    jid = uuid.uuid4().hex
+    job = {'event': {'status': 'queued'}, 'seq': 0, 'finished': None,
+           'changed': threading.Condition()}
+    future = submit_solve(run_job, progress_queue(), jid, request_data)
+    future.add_done_callback(lambda f: finish_job(job, f))
+    # Only a submitted job can finish, and so expire.
+    with jobs_lock:
+        jobs[jid] = job
+    return {'id': jid, 'progress': '/progress/' + jid}, 202
+
+@app.route('/progress/<jid>')
+def progress(jid):
+    expire_jobs()
+    with jobs_lock:
+        job = jobs.get(jid)
+    if job is None:
+        abort(404)
+
+    def stream():
+        seq = None
+        while True:
+            with job['changed']:
+                if job['seq'] == seq:
+                    job['changed'].wait(timeout=15)
+                if job['seq'] == seq:
+                    event = None
+                else:
+                    seq, event, finished = job['seq'], job['event'], job['finished']
+            if event is None:
+                # Comment line, keeps proxies from closing an idle stream.
+                yield b': keep-alive\n\n'
+                continue
+            yield b'data: ' + orjson.dumps(event) + b'\n\n'
+            if finished is not None:
+                return
+
+    return Response(stream(), mimetype='text/event-stream')
+
+if __name__ == '__main__':
+    app.run(debug=False, threaded=True)
@@ -21,28 +21,35 @@
 """Creates a shift scheduling problem and solves it."""
 
 from __future__ import print_function
+from concurrent.futures import ThreadPoolExecutor
 from itertools import combinations
 import argparse
+import collections
+import logging
 import math
+import os
+import pathlib
 
 from google.protobuf import text_format
 from ortools.sat.python import cp_model
-import sys
-sys.stdout = open('brainsolution.txt','wt')
 
-import json
+import orjson
 
+# Solver progress and the resulting schedule are logged at INFO, the input
+# data and model-building details at DEBUG.
+log = logging.getLogger('brain2')
+log.setLevel(logging.INFO)
+log.addHandler(logging.NullHandler())
 
-def test_overlap(t1_st, t1_end, t2_st, t2_end):
 
-    def convert_to_minutes(t_str):
-        hours, minutes = t_str.split(':')
-        return 60*int(hours)+int(minutes)
+def convert_to_minutes(t_str):
+    """Converts an 'HH:MM' string to minutes after midnight."""
+    hours, minutes = t_str.split(':')
+    return 60*int(hours)+int(minutes)
+
 
-    t1_st = convert_to_minutes(t1_st)
-    t1_end = convert_to_minutes(t1_end)
-    t2_st = convert_to_minutes(t2_st)
-    t2_end = convert_to_minutes(t2_end)
+def test_overlap(t1_st, t1_end, t2_st, t2_end):
+    """Tells whether two shifts overlap; times are minutes after midnight."""
 
     # Check for wrapping time differences
     if t1_end < t1_st:
@@ -63,23 +70,164 @@ def test_overlap(t1_st, t1_end, t2_st, t2_end):
     # In all other cases, they have to overlap
     return True
 
+
 def in_nested_list(my_list, item):
     """
     Determines if an item is in my_list, even if nested in a lower-level list.
     """
-    if item in my_list:
-        return True
-    else:
-        return any(in_nested_list(sublist, item) for sublist in my_list if isinstance(sublist, list))
+    stack = [my_list]
+    while stack:
+        current = stack.pop()
+        if item in current:
+            return True
+        stack.extend(sublist for sublist in current if isinstance(sublist, list))
+    return False
+
+
+# Files are read and written next to this module, whatever the working
+# directory of the process that imports it.
+ROOT = pathlib.Path(__file__).resolve().parent
+
+
+# Keys solve_shift_scheduling reads from the request payload.
+REQUIRED_FIELDS = (
+    'skills', 'requests', 'cover_demands', 'weekly_sum_constraints',
+    'funktioner_id_all', 'funktioner_funktion_all',
+    'funktioner_dag_index_sleep', 'funktioner_vagt_index_sleep',
+    'funktioner_vagt_dag_index_sleep', 'funktioner_vagt_night_index_sleep',
+    'equalfunctions', 'equalfunctionsansatte', 'timer', 'calc_time',
+    'ansatte', 'offset', 'period_length', 'number_of_weeks',
+    'fixed_assignments', 'desired_shift_transitions',
+    'desired_day_transistions', 'ansat_arbejdstid', 'ugedag_nummer',
+    'ugedag_dag', 'dates', 'funktioner_tider', 'funktioner_varighed',
+    'normtid', 'funktioner_max_uge', 'allow_overlap', 'allow_combination',
+    'ansatte_number_of_weekends_worked_8weeks')
+
+# Fields sent as JSON-encoded strings inside the payload; the others are plain.
+ENCODED_FIELDS = tuple(
+    field for field in REQUIRED_FIELDS
+    if field not in ('calc_time', 'period_length', 'number_of_weeks'))
+
+
+def decode_fields(data):
+    """Returns a copy of data with the JSON-encoded fields decoded.
+
+  Fields that already hold decoded values are kept as they are, so producers
+  can send a single JSON document instead of encoding each field twice.
+
+  Raises:
+    ValueError: a field holds a string that is not valid JSON.
+  """
+    fields = dict(data)
+    for field in ENCODED_FIELDS:
+        if isinstance(fields[field], (str, bytes)):
+            try:
+                fields[field] = orjson.loads(fields[field])
+            except orjson.JSONDecodeError as e:
+                raise ValueError('%s is not valid JSON: %s' % (field, e))
+    return fields
+
+
+def validate(data):
+    """Returns an error message if data is not a usable payload, else None."""
+    if not isinstance(data, dict):
+        return 'payload must be a JSON object'
+    missing = [field for field in REQUIRED_FIELDS if field not in data]
+    if missing:
+        return 'missing fields: %s' % ', '.join(missing)
+    # Only the types are checked here; decode_fields parses the strings.
+    wrong = [field for field in ENCODED_FIELDS
+             if not isinstance(data[field], (str, list, dict))]
+    if wrong:
+        return 'fields must be JSON strings, arrays or objects: %s' % ', '.join(wrong)
+    return None
+
+
+# Side-output files are written from a background thread so the schedule
+# can be returned without waiting on the disk.
+PERSIST = ThreadPoolExecutor(max_workers=1)
+
+
+def write_text(path, text):
+    with open(path, 'w') as f:
+        f.write(text)
+
+
+# Where brainsolution.txt and OutFile.txt go, and a suffix for their names;
+# pool workers set their own so they don't overwrite each other's files.
+OUTPUT_DIR = ROOT
+OUTPUT_SUFFIX = ''
+
+
+def output_path(name):
+    """Returns the path of side-output file name.txt for this process."""
+    return OUTPUT_DIR / ('%s%s.txt' % (name, OUTPUT_SUFFIX))
+
+
+def pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def init_worker(output_dir):
+    """Pool initializer: writes this process's side-output files to
+    output_dir, named by its pid, and removes those of workers that are gone.
+    """
+    global OUTPUT_DIR, OUTPUT_SUFFIX
+    OUTPUT_DIR = pathlib.Path(output_dir)
+    OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
+    OUTPUT_SUFFIX = '-%i' % os.getpid()
+    for path in OUTPUT_DIR.glob('*-*.txt'):
+        pid = path.stem.rpartition('-')[2]
+        if pid.isdigit() and not pid_alive(int(pid)):
+            path.unlink(missing_ok=True)
 
 
 PARSER = argparse.ArgumentParser()
 PARSER.add_argument(
     '--output_proto',
     default="",
-    help='Output file to write the cp_model'
-    'proto to.')
+    help='Output file to write the cp_model proto to; binary unless the name'
+    ' ends in .txt.')
 PARSER.add_argument('--params', default="", help='Sat solver parameters.')
+PARSER.add_argument(
+    '--verbose',
+    action='store_true',
+    help='Also log the input data and model details.')
+PARSER.add_argument(
+    '--warm_start',
+    action='store_true',
+    help='Hint the solver with the previous schedule in brain.json.')
+
+
+class ObjectiveSolutionLogger(cp_model.CpSolverSolutionCallback):
+    """
+    Logs the objective value of each solution found, and reports it to
+    progress, if given, with pct the share of time_limit used so far.
+    """
+
+    def __init__(self, progress=None, time_limit=0):
+        cp_model.CpSolverSolutionCallback.__init__(self)
+        self.__solution_count = 0
+        self.__progress = progress
+        self.__time_limit = time_limit
+
+    def on_solution_callback(self):
+        wall_time = self.WallTime()
+        objective = self.ObjectiveValue()
+        log.info('Solution %i, time = %0.2f s, objective = %i',
+                 self.__solution_count, wall_time, objective)
+        if self.__progress is not None:
+            pct = min(99, int(100 * wall_time / self.__time_limit)) if self.__time_limit else 0
+            self.__progress({'status': 'running', 'pct': pct,
+                             'solution': self.__solution_count,
+                             'objective': objective, 'time': round(wall_time, 2)})
+        self.__solution_count += 1
 
 
 def negated_bounded_span(works, start, length):
@@ -143,10 +291,18 @@ def add_soft_sequence_constraint(model, works, hard_min, soft_min, min_cost,
     cost_literals = []
     cost_coefficients = []
 
-    # Forbid sequences that are too short.
-    for length in range(1, hard_min):
-        for start in range(len(works) - length + 1):
-            model.AddBoolOr(negated_bounded_span(works, start, length))
+    # Forbid sequences that are too short or too long. The automaton state is
+    # the length of the current run of true variables: a run can only grow up
+    # to hard_max, and can only end (or reach the end of works) once it is at
+    # least hard_min long.
+    transitions = [(0, 0, 0)]
+    for length in range(hard_max + 1):
+        if length < hard_max:
+            transitions.append((length, 1, length + 1))
+        if length >= max(hard_min, 1):
+            transitions.append((length, 0, 0))
+    final_states = [0] + list(range(max(hard_min, 1), hard_max + 1))
+    model.AddAutomaton(works, 0, final_states, transitions)
 
     # Penalize sequences that are below the soft limit.
     if min_cost > 0:
@@ -175,10 +331,6 @@ def add_soft_sequence_constraint(model, works, hard_min, soft_min, min_cost,
                 # Cost paid is max_cost * excess length.
                 cost_coefficients.append(max_cost * (length - soft_max))
 
-    # Just forbid any sequence of true variables with length hard_max + 1
-    for start in range(len(works) - hard_max):
-        model.AddBoolOr(
-            [works[i].Not() for i in range(start, start + hard_max + 1)])
     return cost_literals, cost_coefficients
 
 
@@ -239,76 +391,107 @@ def add_soft_sum_constraint(model, works, hard_min, soft_min, min_cost,
     return cost_variables, cost_coefficients
 
 
-def solve_shift_scheduling(params, output_proto):
-    import json
-    import pickle
-   
-    with open('data.json', 'r') as f:
-        data=json.load(f)
-   
-    skills = json.loads(data['skills'])
-    requests = json.loads(data['requests'])
-    cover_demands = json.loads(data['cover_demands'])
-    weekly_sum_constraints = json.loads(data['weekly_sum_constraints'])
-    funktioner_id_all = json.loads(data['funktioner_id_all'])
-    print('funktioner_id_all',funktioner_id_all)
-    funktioner_funktion_all = json.loads(data['funktioner_funktion_all'])
+def add_lex_less_or_equal(model, xs, ys):
+    """Lexicographic order between two vectors of Boolean variables.
+
+  Forbids any assignment where xs comes after ys in lexicographic order.
+  This is used to break the symmetry between interchangeable employees.
+
+  Args:
+    model: the constraint is built on this model.
+    xs: a list of Boolean variables.
+    ys: a list of Boolean variables of the same length as xs.
+  """
+    # While all previous positions are equal, x <= y must hold. The prefix
+    # stays equal as long as x == y, which given x <= y is (not x) and y.
+    prefix = []
+    for i, (x, y) in enumerate(zip(xs, ys)):
+        model.AddBoolOr(prefix + [x.Not(), y])
+        if i == len(xs) - 1:
+            break
+        equal = model.NewBoolVar('')
+        model.AddBoolOr(prefix + [y, equal])
+        model.AddBoolOr(prefix + [x.Not(), equal])
+        prefix = [equal.Not()]
+
+
+def solve_shift_scheduling(data, params, output_proto, hint=None, progress=None):
+    """Solves the shift scheduling problem described by data.
+
+  If hint is a previous result, its assignments on dates of this period are
+  given to the solver as a starting point. progress, if given, is called with
+  a {'status': 'running', 'pct': ...} dict when the search starts and for each
+  solution found.
+
+  Returns:
+    a dict mapping each shift name to a list of {date: employees} entries, or
+    an empty dict if no feasible schedule was found.
+  """
+    fields = decode_fields(data)
+    skills = fields['skills']
+    requests = fields['requests']
+    cover_demands = fields['cover_demands']
+    weekly_sum_constraints = fields['weekly_sum_constraints']
+    funktioner_id_all = fields['funktioner_id_all']
+    log.debug('funktioner_id_all %s', funktioner_id_all)
+    funktioner_funktion_all = fields['funktioner_funktion_all']
     funktioner_liste = list(range(0,len(funktioner_funktion_all)))
-    print('funktioner_liste', funktioner_liste)
-    funktioner_dag_index_sleep = json.loads(data['funktioner_dag_index_sleep'])
-    print('valgte dagfunktioner', funktioner_dag_index_sleep)
-    funktioner_vagt_index_sleep = json.loads(data['funktioner_vagt_index_sleep'])
-    print('valgte vagter', funktioner_vagt_index_sleep )
-    funktioner_vagt_dag_index_sleep = json.loads(data['funktioner_vagt_dag_index_sleep'])
-    print('valgte dagvagter', funktioner_vagt_index_sleep )
-    funktioner_vagt_night_index_sleep = json.loads(data['funktioner_vagt_night_index_sleep'])
-    print('valgte nattevagter',funktioner_vagt_night_index_sleep)
+    log.debug('funktioner_liste %s', funktioner_liste)
+    funktioner_dag_index_sleep = fields['funktioner_dag_index_sleep']
+    log.debug('valgte dagfunktioner %s', funktioner_dag_index_sleep)
+    funktioner_vagt_index_sleep = fields['funktioner_vagt_index_sleep']
+    log.debug('valgte vagter %s', funktioner_vagt_index_sleep)
+    funktioner_vagt_dag_index_sleep = fields['funktioner_vagt_dag_index_sleep']
+    log.debug('valgte dagvagter %s', funktioner_vagt_index_sleep)
+    funktioner_vagt_night_index_sleep = fields['funktioner_vagt_night_index_sleep']
+    log.debug('valgte nattevagter %s', funktioner_vagt_night_index_sleep)
     night_shifts = funktioner_vagt_night_index_sleep
     #daytime_oncall_shifts = funktioner_vagt_dag_index_sleep
-    print ('nattevagter' , night_shifts)
-    print('antal nattevagter', len(night_shifts))
+    log.debug('nattevagter %s', night_shifts)
+    log.debug('antal nattevagter %s', len(night_shifts))
     
-    equalfunctions = json.loads(data['equalfunctions'])
-    equalfunctionsansatte = json.loads(data['equalfunctionsansatte'])
+    equalfunctions = fields['equalfunctions']
+    equalfunctionsansatte = fields['equalfunctionsansatte']
     
-    print('equalfunntionansatte', equalfunctionsansatte)
+    log.debug('equalfunntionansatte %s', equalfunctionsansatte)
     #timer (ansat:arbejdstimer(fri ønkser+timer for ikke valgte funktioner), dagvagter, nattevagter, resttimer
-    timer = json.loads(data['timer'])
-    print('timer -arb timer dagvagter, nattevagter, rest', timer)
+    timer = fields['timer']
+    log.debug('timer -arb timer dagvagter, nattevagter, rest %s', timer)
     calc_time = int(data['calc_time'])
     #calc_time=300
-    print('tænketid: ',calc_time)
+    log.debug('tænketid: %s', calc_time)
     #print('calc_time', data['calc_time'])
     #print ('data', data)
     
-    ansatte = json.loads(data['ansatte'])
-    offset = json.loads(data['offset'])
+    ansatte = fields['ansatte']
+    offset = fields['offset']
     period_length = data['period_length']
     number_of_weeks = data['number_of_weeks']
-    fixed_assignments = json.loads(data['fixed_assignments'])
-    desired_shift_transitions = json.loads(data['desired_shift_transitions'])
-    desired_day_transistions = json.loads(data['desired_day_transistions'])
-    ansat_arbejdstid = json.loads(data['ansat_arbejdstid'])
-    ugedag_nummer = json.loads(data['ugedag_nummer'])
-    ugedag_dag = json.loads(data['ugedag_dag'])
-    dates = json.loads(data['dates'])
-    funktioner_tider = json.loads(data['funktioner_tider'])
-    funktioner_varighed = json.loads(data['funktioner_varighed'])
-    normtid= json.loads(data['normtid'])
+    fixed_assignments = fields['fixed_assignments']
+    desired_shift_transitions = fields['desired_shift_transitions']
+    desired_day_transistions = fields['desired_day_transistions']
+    ansat_arbejdstid = fields['ansat_arbejdstid']
+    ugedag_nummer = fields['ugedag_nummer']
+    ugedag_dag = fields['ugedag_dag']
+    dates = fields['dates']
+    funktioner_tider = fields['funktioner_tider']
+    funktioner_varighed = fields['funktioner_varighed']
+    normtid= fields['normtid']
 
    
-    funktioner_max_uge = json.loads(data['funktioner_max_uge'])
-    funktioner_allow_overlap = json.loads(data['allow_overlap'])
-    print('funktioner_allow_overlap', funktioner_allow_overlap);
+    funktioner_max_uge = fields['funktioner_max_uge']
+    funktioner_allow_overlap = fields['allow_overlap']
+    log.debug('funktioner_allow_overlap %s', funktioner_allow_overlap);
     
-    funktioner_no_overlap= [shift for shift in funktioner_liste if shift not in funktioner_allow_overlap]
-    print('funktioner_no_overlap',funktioner_no_overlap)
+    allow_overlap = set(funktioner_allow_overlap)
+    funktioner_no_overlap= [shift for shift in funktioner_liste if shift not in allow_overlap]
+    log.debug('funktioner_no_overlap %s', funktioner_no_overlap)
     
-    funktioner_allow_combination = json.loads(data['allow_combination'])
+    funktioner_allow_combination = fields['allow_combination']
     funktioner_no_combination= [shift for shift in funktioner_liste if shift not in funktioner_allow_combination]
-    print('funktioner_no_combination',funktioner_no_combination)
+    log.debug('funktioner_no_combination %s', funktioner_no_combination)
    
-    print('normtid', normtid)
+    log.debug('normtid %s', normtid)
    
    
     
@@ -317,31 +500,31 @@ def solve_shift_scheduling(params, output_proto):
         fixed_assignments_shift_day.append([x[1],x[2]])
     
   
-    print ('fixed', fixed_assignments)    
-    print('funktioner liste', funktioner_liste)
-    print('equalfunctions', equalfunctions)
-    print('funktionstider', funktioner_tider)
-    print('funktionsvarighed', funktioner_varighed)
-    print('funktioner max', funktioner_max_uge)
-    print('dv var', funktioner_varighed[str(1)])
+    log.debug('fixed %s', fixed_assignments)    
+    log.debug('funktioner liste %s', funktioner_liste)
+    log.debug('equalfunctions %s', equalfunctions)
+    log.debug('funktionstider %s', funktioner_tider)
+    log.debug('funktionsvarighed %s', funktioner_varighed)
+    log.debug('funktioner max %s', funktioner_max_uge)
+    log.debug('dv var %s', funktioner_varighed[str(1)])
    
-    print('fkt tid 0', funktioner_tider['1'][2])
-    print('dates', dates, 'funktioner tider' , funktioner_tider, 'ugedag_nummer',  ugedag_nummer)
-    print('desired_day_transistions', desired_day_transistions)
-    print(desired_shift_transitions, 'desired_shift_transitions')
-    print ('offset', offset)
-    print ('fixed assignments', fixed_assignments)
-    print('skills', skills)
-    print ('funktioner id', funktioner_id_all)
-    print ('arbejdstid', '1', int(math.floor(ansat_arbejdstid[0][1])*100/37))
-    print ('ansatte', ansatte)
+    log.debug('fkt tid 0 %s', funktioner_tider['1'][2])
+    log.debug('dates %s funktioner tider %s ugedag_nummer %s', dates, funktioner_tider, ugedag_nummer)
+    log.debug('desired_day_transistions %s', desired_day_transistions)
+    log.debug('%s desired_shift_transitions', desired_shift_transitions)
+    log.debug('offset %s', offset)
+    log.debug('fixed assignments %s', fixed_assignments)
+    log.debug('skills %s', skills)
+    log.debug('funktioner id %s', funktioner_id_all)
+    log.debug('arbejdstid 1 %s', int(math.floor(ansat_arbejdstid[0][1])*100/37))
+    log.debug('ansatte %s', ansatte)
     
     
-    print('antal ansatte', len(ansatte))
-    print(weekly_sum_constraints)
-    print('alle funktioner', funktioner_funktion_all)
-    print ('cover_demands', cover_demands)
-    print('requests', requests)
+    log.debug('antal ansatte %s', len(ansatte))
+    log.debug('%s', weekly_sum_constraints)
+    log.debug('alle funktioner %s', funktioner_funktion_all)
+    log.debug('cover_demands %s', cover_demands)
+    log.debug('requests %s', requests)
     
     
     
@@ -376,50 +559,67 @@ def solve_shift_scheduling(params, output_proto):
         
          
    # ]
-#wanted    
-    rewarded_transitions = []
-        # B_DV skal efterfølges af B_NV straffes 4
- #       (3, 7, 4),
-        # F_DV skal efterfølges af F_NV 0=hard contraint
-     #   (1, 2, 4),
-      
-        # Night to morning is forbidden.
-        #(3, 1, 0),
-   # ]
    
     
-    ansatte_dummy = ansatte.copy()
-    ansatte_dummy.append('?')
-    print('ansatte', ansatte, 'dummy', ansatte_dummy, 'længde', len(ansatte_dummy))
+    log.debug('ansatte %s længde %s', ansatte, len(ansatte))
     employees= ansatte.copy()
-    employees_dummy=ansatte_dummy.copy()
     num_employees = len(employees)
-    num_employees_dummy = len( employees_dummy)
-    print('ansatte dummy', ansatte_dummy)
-    print('empl dummy ', employees_dummy)
+    employee_index = {name: i for i, name in enumerate(ansatte)}
     num_weeks = number_of_weeks
-    print('num_weeks',num_weeks)
+    log.debug('num_weeks %s', num_weeks)
     shifts = funktioner_funktion_all
     num_shifts = len(shifts)
-    print('antal funktioner', num_shifts, 'alle valte funktioner', funktioner_funktion_all)
+    log.debug('antal funktioner %s alle valte funktioner %s', num_shifts, funktioner_funktion_all)
     
     #shifts = funktioner_funktion_all
     #num_shifts = len(shifts)
     #print('antal funktioner', num_shifts)
     
     num_days = int(period_length)
-    print('antal dage', int(period_length) )
+    # Days after the offset, the part of the period being scheduled.
+    days_range = range(offset, num_days)
+    log.debug('antal dage %s', int(period_length))
+
+    # Per-shift hours and durations, looked up by shift index in the model
+    # loops. Shift 0 is the day off.
+    shift_hours = [0.0] + [float(funktioner_tider[str(s)][2]) for s in range(1, num_shifts)]
+    durations = [0] + [int(funktioner_varighed[str(s)]) for s in range(1, num_shifts)]
+    # Shifts under 6 hours, which must be combined with another shift that day.
+    short_shifts = [s for s in range(1, num_shifts) if shift_hours[s] < 6]
    
     
     
 # """Solves the shift scheduling problem.""" 
     model = cp_model.CpModel()
 
-    work = {}
-    for e in range(num_employees_dummy):
-        for s in range(num_shifts):
-            for d in range(num_days):
-                work[e, s, d] = model.NewBoolVar('work%i_%i_%i' % (e, s, d))
+# skills: a skill of 0 rules the shift out from the offset on (earlier days may
+# predate a skill change), except where it is a fixed assignment.
+    fixed_cells = {tuple(x) for x in fixed_assignments}
+    unskilled = {(e, s, d) for e, s, k in skills if k==0
+                 for d in days_range if (e, s, d) not in fixed_cells}
+
+    # work[e][s][d]: employee e works shift s on day d; ruled out cells are
+    # the constant 0 instead of a variable.
+    zero = model.NewConstant(0)
+    work = [[[zero if (e, s, d) in unskilled else model.NewBoolVar('')
+              for d in range(num_days)]
+             for s in range(num_shifts)]
+            for e in range(num_employees)]
+
+# warm start: employees listed under a shift and date of the hint are hinted
+# to work it, the others not to.
+    if hint:
+        day_index = {date: d for d, date in enumerate(dates)}
+        for s, shift in enumerate(shifts):
+            for entry in hint.get(shift, ()):
+                for date, names in entry.items():
+                    d = day_index.get(date)
+                    if d is None:
+                        continue
+                    hinted = set(names.split())
+                    for e in range(num_employees):
+                        if work[e][s][d] is not zero:
+                            model.AddHint(work[e][s][d], int(employees[e] in hinted))
        
 
     
@@ -429,57 +629,84 @@ def solve_shift_scheduling(params, output_proto):
     obj_int_coeffs = []
     obj_bool_vars = []
     obj_bool_coeffs = []
+    # Linear expressions penalized directly, without a channeling IntVar.
+    obj_linear_exprs = []
+    obj_linear_coeffs = []
 
 
 # Max shift per e per day.
     for e in range(num_employees):
         for d in range(num_days):
-            model.Add(sum(work[e, s, d] for s in range(num_shifts)) <= 2)
-            model.Add(sum(work[e, s, d] for s in range(num_shifts)) >= 1)
-            model.Add(sum(work[e, s, d] for s in funktioner_no_combination) <= 1)
-            #model.Add(sum(work[e, s, d] for s in range(funktioner_allow_combination)) <= 2)
+            shifts_today = cp_model.LinearExpr.Sum([work[e][s][d] for s in range(num_shifts)])
+            model.AddLinearConstraint(shifts_today, 1, 2)
+            model.AddAtMostOne([work[e][s][d] for s in funktioner_no_combination])
+            #model.Add(sum(work[e][s][d] for s in range(funktioner_allow_combination)) <= 2)
             
-            #model.Add((sum(work[e, s, d] for s in night_shifts)+work[e,0,d] ) <= 1)
+            #model.Add((sum(work[e][s][d] for s in night_shifts)+work[e][0][d] ) <= 1)
             #if shift duration < 6 hours shift must be combined with another shift
-            for s in range(1, num_shifts):
-                if (float(funktioner_tider[str(s)][2]) < 6):
-                    model.Add(sum(work[e, s, d] for s in range(num_shifts)) > 1).OnlyEnforceIf(work[e, s, d])  
-            #model.Add(sum(work[e, s, d]* int(funktioner_varighed[str(s)]) for s in range(num_shifts)) > 6).OnlyEnforceIf(work[e, s, d])  
+            for s in short_shifts:
+                model.Add(shifts_today >= 2).OnlyEnforceIf(work[e][s][d])
+            #model.Add(sum(work[e][s][d]* int(funktioner_varighed[str(s)]) for s in range(num_shifts)) > 6).OnlyEnforceIf(work[e][s][d])  
 
         
 # constraint if one shift duration < 6 hours other shift same day is not free (0)
-    for s in range(1, num_shifts):
-        if (float(funktioner_tider[str(s)][2]) < 6):
-            #print('tider max', funktioner_tider[str(s)])
-            for d in range(num_days):
-                for e in range(num_employees):
-                    model.AddBoolOr([work[e,s,d].Not(), work[e,0,d].Not()])
+    for s in short_shifts:
+        for d in range(num_days):
+            for e in range(num_employees):
+                model.AddBoolOr([work[e][s][d].Not(), work[e][0][d].Not()])
                                 
 
-#dummy
-    for d in range(num_days):        
-        model.Add(sum(work[num_employees_dummy-1, s, d] for s in range(num_shifts)) >= 1)   
+#unfilled slots: unfilled[s, d] workers missing from shift s on day d, shown as '?'
+#in the schedule. Before offset at most one slot per shift may stay open, unpenalized.
+    unfilled = {}
+    for d in range(num_days):
+        for s in range(1, num_shifts):
+            needed = cover_demands[d][s-1]
+            unfilled[s, d] = model.NewIntVar(0, needed if d >= offset else min(needed, 1), '')
 
-#dummy penalty    
-    num_dummy= sum(work[num_employees_dummy-1, s, d] for s in range(1,num_shifts) for d in range(offset, num_days))
-    num_dummy_v = model.NewIntVar(0,num_days*num_shifts,'num_dummies')
+#unfilled penalty
+    num_dummy= sum(unfilled[s, d] for s in range(1,num_shifts) for d in days_range)
+    num_dummy_v = model.NewIntVar(0,sum(cover_demands[d][s-1] for s in range(1,num_shifts) for d in days_range),'num_dummies')
     model.Add(num_dummy_v==num_dummy)
     obj_int_vars.append(num_dummy_v)
     obj_int_coeffs.append(300)
 
 # constraint where 2 shifts are assigned to employee, these must not overlap
-    
-    for (s1, s2) in combinations(funktioner_no_overlap, 2):
-        if test_overlap(funktioner_tider[str(s1)][0], funktioner_tider[str(s1)][1], funktioner_tider[str(s2)][0], funktioner_tider[str(s2)][1]):
-            for d in range(num_days):
-                for e in range(num_employees):
-                    model.AddBoolOr([work[e,s1,d].Not(), work[e,s2,d].Not()])
+# shift_parts[s]: (start, size) in minutes after midnight. A shift ending before
+# it starts runs past midnight and is split into an evening and a morning part.
+    shift_minutes = {
+        s: (convert_to_minutes(funktioner_tider[str(s)][0]), convert_to_minutes(funktioner_tider[str(s)][1]))
+        for s in funktioner_no_overlap
+    }
+    shift_parts = {}
+    for s, (start, end) in shift_minutes.items():
+        if end < start:
+            parts = [(start, 24*60 - start), (0, end)]
+        else:
+            parts = [(start, end - start)]
+        shift_parts[s] = [(st, size) for st, size in parts if size > 0]
+    log.debug('shift_parts %s', shift_parts)
+    # A zero-length shift, such as a 00:00-00:00 day off, has no interval, so
+    # its conflicts are taken pair by pair from test_overlap.
+    point_overlaps = [
+        (s1, s2) for s1, s2 in combinations(funktioner_no_overlap, 2)
+        if not (shift_parts[s1] and shift_parts[s2])
+        and test_overlap(*shift_minutes[s1], *shift_minutes[s2])
+    ]
+    log.debug('point_overlaps %s', point_overlaps)
+    for d in range(num_days):
+        for e in range(num_employees):
+            model.AddNoOverlap([
+                model.NewOptionalFixedSizeIntervalVar(st, size, work[e][s][d], '')
+                for s, parts in shift_parts.items() for st, size in parts])
+            for s1, s2 in point_overlaps:
+                model.AddBoolOr([work[e][s1][d].Not(), work[e][s2][d].Not()])
 
 # constraint if overlap make sure 2. shift same day is not 0 to avoid e getting overlap when free
     for s in funktioner_allow_overlap:
         for d in range(num_days):
             for e in range(num_employees):
-                model.AddBoolOr([work[e,s,d].Not(), work[e,0,d].Not()])                    
+                model.AddBoolOr([work[e][s][d].Not(), work[e][0][d].Not()])                    
                     
                         
     
@@ -487,7 +714,7 @@ def solve_shift_scheduling(params, output_proto):
     for e, s, d in fixed_assignments:
         #if d>offset:
         if d>(offset-1):
-            model.Add(work[e, s, d] == 1)
+            model.Add(work[e][s][d] == 1)
     
 
 # Employee requests
@@ -496,11 +723,11 @@ def solve_shift_scheduling(params, output_proto):
         #if d>offset:    
             if w==0:
                 #print(ansatte[e],s,d,w, 'tider', funktioner_tider[str(s)][0], funktioner_tider[str(s)][1])
-                model.Add(work[e,s,d] == 1)
+                model.Add(work[e][s][d] == 1)
                 
                
             else:
-                obj_bool_vars.append(work[e, s, d])
+                obj_bool_vars.append(work[e][s][d])
                 obj_bool_coeffs.append(w)
 
    
@@ -509,40 +736,37 @@ def solve_shift_scheduling(params, output_proto):
         for s in range(1, num_shifts):
             #if [s,d] not in fixed_assignments_shift_day: #avoid fixed assignment conflict
                 needed = cover_demands[d][s-1]
-                model.Add(sum(work[e, s, d] for e in range(num_employees_dummy)) == needed )  
+                model.Add(sum(work[e][s][d] for e in range(num_employees)) + unfilled[s, d] == needed )  
 
-# rest after nightshift
-    for night_shift in night_shifts:
+# rest after nightshift: any night shift on day d forces the day off on d + 1.
+    if night_shifts:
         for e in range(num_employees):
             for d in range(num_days - 1):
-             #   for s in range(len(shifts)):
-              #      if s != night_shift:
-                        #sleep_transition = [
-                         #   work[e, night_shift, d].Not(),
-                          #  work[e, 0, d + 1].Not()
-                        #]
-                       #model.AddBoolOr(sleep_transition)
-                       model.Add(work[e, 0, d + 1]==1).OnlyEnforceIf(work[e, night_shift, d])
-                       #model.AddBoolOr([work[e, 0, d].Not(), work[e, night_shift, d].Not()])
-                       
-   #  model.Add(work[e, 0, d]==1 for d in range(num_days) for e in range(num_empl) ).OnlyEnforceIf(work[e, night_shift, d])                        
+                model.Add(cp_model.LinearExpr.Sum([work[e][s][d] for s in night_shifts])
+                          <= len(night_shifts) * work[e][0][d + 1])
 
 #max 1 nightshift indenfor 7 dage
-    for e in range(num_employees):
-        for d in range(offset, num_days-7):
-            model.Add(sum(work[e, s, x] for s in (night_shifts) for x in range(d,d+7)) <= 1)
+    if num_days - 7 > offset:
+        for e in range(num_employees):
+            # nights_before[d] counts the night shifts worked from offset up to day d - 1.
+            nights_before = {offset: 0}
+            for d in range(offset, num_days - 1):
+                nights_before[d + 1] = model.NewIntVar(0, num_days, '')
+                model.Add(nights_before[d + 1] == nights_before[d] + cp_model.LinearExpr.Sum([work[e][s][d] for s in night_shifts]))
+            for d in range(offset, num_days-7):
+                model.Add(nights_before[d + 7] - nights_before[d] <= 1)
 
 
 #    for e in range(num_employees):
 #            for s, max in funktioner_max_uge:
 #                for d in range(num_days-7):
-#                    model.Add(sum(work[e, s, x] for x in range(d,d+7)) <= 7)
+#                    model.Add(sum(work[e][s][x] for x in range(d,d+7)) <= 7)
 
 
 #max 1 nightshift indenfor 7 dage
 #    for e in range(num_employees):
 #        for d in range(num_days-7):
-#            nights_worked_sevendays = [work[e, s, x] for s in (night_shifts) for x in range(d,d+7)]
+#            nights_worked_sevendays = [work[e][s][x] for s in (night_shifts) for x in range(d,d+7)]
 #            max_nights = 1
 #            nights_worked = model.NewIntVar(0, 7, '')
 #            model.Add(nights_worked == sum(nights_worked_sevendays))
@@ -557,14 +781,12 @@ def solve_shift_scheduling(params, output_proto):
     for e in range(num_employees):
         for s, max in funktioner_max_uge:
             for w in range(num_weeks):
-                shifts_worked_sevendays = sum(work[e, s, x] for x in range(w*7,w*7+6) )
+                shifts_worked_sevendays = sum(work[e][s][x] for x in range(w*7,w*7+6) )
                 max_shifts = int(max)
-                shifts_worked = model.NewIntVar(0, 7, '')
-                model.Add(shifts_worked == shifts_worked_sevendays)
                 over_penalty_shifts = 4
                 name = 'excess_shifts(empl=%i, shift=%i, day=%i)' % (e, s, d)
-                excess_shifts = model.NewIntVar(-7, 7, name)
-                model.Add(excess_shifts == (max_shifts - shifts_worked))
+                excess_shifts = model.NewIntVarFromDomain(cp_model.Domain(0, max_shifts), name)
+                model.Add(excess_shifts >= max_shifts - shifts_worked_sevendays)
                 obj_int_vars.append(excess_shifts)
                 obj_int_coeffs.append(over_penalty_shifts)
 
@@ -572,18 +794,19 @@ def solve_shift_scheduling(params, output_proto):
 
 
 #fordel timer, max timer   
+    hours_worked = {}
+    # Same order as the work literals below: shift-major, then day.
+    hour_coeffs = [durations[s] for s in range(1, num_shifts) for d in days_range]
     for e in range(num_employees):
-        num_hours_worked = sum( work[e, s, d] * int(funktioner_varighed[str(s)]) for s in range(1, num_shifts) for d in range (offset, num_days) )
+        hours_worked[e] = cp_model.LinearExpr.WeightedSum(
+            [work[e][s][d] for s in range(1, num_shifts) for d in days_range],
+            hour_coeffs)
         max_workhour = int(37*normtid / ansat_arbejdstid[e][1])
-        #hours_worked = model.NewIntVar(0,num_days*24,'')
-        hours_worked = model.NewIntVar(0, max_workhour,'')
-        model.Add(hours_worked==num_hours_worked)
-        penalty = -10
-        name = 'excess_workhours(empl=%i)' % (e)
-        excess_workhours=model.NewIntVar(0,num_days*24, name)
-        model.Add(excess_workhours== max_workhour - hours_worked) 
-        obj_int_vars.append(excess_workhours)
-        obj_int_coeffs.append(penalty)
+        model.Add(hours_worked[e] <= max_workhour)
+        # -10 per hour left below max_workhour, minus its constant part.
+        penalty = 10
+        obj_linear_exprs.append(hours_worked[e])
+        obj_linear_coeffs.append(penalty)
         
         #norm_hours=int(normtid * ansat_arbejdstid[s][1]/37)
         #penalty = -
@@ -597,7 +820,7 @@ def solve_shift_scheduling(params, output_proto):
 #penalty for 2 weekends in a row
 #    for e in range(num_employees):
 #        for w in range(num_weeks-2):
-#            num_two_consecutive_weekends = sum(work[e, s, w*7+5]+work[e, s, w*7+6]+work[e, s, w*7+12]+work[e, s, w*7+13] for s in range(1,num_shifts) )
+#            num_two_consecutive_weekends = sum(work[e][s][w*7+5]+work[e][s][w*7+6]+work[e][s][w*7+12]+work[e][s][w*7+13] for s in range(1,num_shifts) )
 #            num_two_consecutive_weekends_v = model.NewIntVar(0,4,'two_consecutive_weekends_v')
 #            model.Add(num_two_consecutive_weekends_v==num_two_consecutive_weekends)
 #            obj_int_vars.append(num_two_consecutive_weekends_v)
@@ -611,7 +834,7 @@ def solve_shift_scheduling(params, output_proto):
 #    for e in range(num_employees):
 #        for s in night_shifts:
 #            sum_of_shifts[(e, s)] = model.NewIntVar(0, num_days, 'sum_of_shifts_%i_%i' % (e, s))
-#            model.Add(sum_of_shifts[(e, s)] == sum(work[e, s, d] for d in range(num_days)))
+#            model.Add(sum_of_shifts[(e, s)] == sum(work[e][s][d] for d in range(num_days)))
             
 #    for s in night_shifts:
 #        min_fair_shift = model.NewIntVar(0, num_days, 'min_fair_shift_%i' % s)
@@ -626,67 +849,51 @@ def solve_shift_scheduling(params, output_proto):
 
 
 #equalize number of weekends worked inc friday night
-    if 2>1:
-        ansatte_number_of_weekends_worked_8weeks = json.loads(data['ansatte_number_of_weekends_worked_8weeks'])
-        print('ansatte_number_of_weekends_worked_8weeks',ansatte_number_of_weekends_worked_8weeks)
-        
-        weekends_worked = {}
-        weekends = {}
-        weekends_in_month = {}
-        total_weekends = {}
-        trans_avoid_2weekends = {}
-        trans_avoid_2weekends_var = {}
-        total = {}
-        weekenddays_worked_int = {}
-        weekenddays_worked = {}
-        for e in range(num_employees):
-            for w in range(number_of_weeks):
-                b=model.NewBoolVar('b')
-                weekenddays_worked[e, w]=model.NewBoolVar('weekenddays_worked[%i,%i]' % (e,w))
-                weekenddays_worked_int[e, w] = model.NewIntVar(0, number_of_weeks*3,  'weekenddays_worked_int[%i,%i]' % (e,w) )
-                weekends[e, w] = model.NewIntVar(0, number_of_weeks,  'weekends[%i,%i]' % (e,w) )
-        
-                model.Add(weekenddays_worked_int[e, w] ==( sum(work[e, s, w*7+5]+work[e, s, w*7+6] for s in range(1,num_shifts)) +sum(work[e, friday, w*7+4] for friday in night_shifts  )) )
-                model.Add(weekenddays_worked_int[e, w]>0).OnlyEnforceIf(b)
-                model.Add(weekenddays_worked_int[e, w]==0).OnlyEnforceIf(b.Not())
+    ansatte_number_of_weekends_worked_8weeks = fields['ansatte_number_of_weekends_worked_8weeks']
+    log.debug('ansatte_number_of_weekends_worked_8weeks %s', ansatte_number_of_weekends_worked_8weeks)
+    
+    weekends_in_month = {}
+    total_weekends = {}
+    # weekend_work[e, w]: the literals that make week w a worked weekend
+    # (any saturday or sunday shift, or a friday night shift).
+    weekend_work = {}
+    weekenddays_worked = {}
+    for e in range(num_employees):
+        for w in range(number_of_weeks):
+            weekend_work[e, w] = ([work[e][s][w*7+5] for s in range(1, num_shifts)]
+                                  + [work[e][s][w*7+6] for s in range(1, num_shifts)]
+                                  + [work[e][friday][w*7+4] for friday in night_shifts])
+            weekenddays_worked[e, w]=model.NewBoolVar('weekenddays_worked[%i,%i]' % (e,w))
+            model.AddMaxEquality(weekenddays_worked[e, w], weekend_work[e, w])
+    #avoid two weekends in a row
+        cost=8
+        for wc in range(number_of_weeks-1):
+            trans_avoid_2weekends_var = model.NewBoolVar('trans_avoid_2weekends (employee=%i, week=%i)' % (e, wc))
+            model.Add(trans_avoid_2weekends_var >= weekenddays_worked[e, wc] + weekenddays_worked[e, wc+1] - 1)
+            obj_bool_vars.append(trans_avoid_2weekends_var)
+            obj_bool_coeffs.append(cost)
                 
-                model.Add(weekenddays_worked[e, w]==1).OnlyEnforceIf(b)
-                model.Add(weekenddays_worked[e, w]==0).OnlyEnforceIf(b.Not())
                 
-                #model.AddDivisionEquality(weekends[e, w],weekenddays_worked_int[e, w],3)
-        #avoid two weekends in a row
-            if 1<2:
-                cost=8
-                for wc in range(number_of_weeks-1):
-                    trans_avoid_2weekends = [weekenddays_worked[e, wc].Not(), weekenddays_worked[e, wc+1].Not()]
-                    trans_avoid_2weekends_var = model.NewBoolVar('trans_avoid_2weekends (employee=%i, week=%i)' % (e, wc))
-                    
-                    trans_avoid_2weekends.append(trans_avoid_2weekends_var)     
-                    model.AddBoolOr(trans_avoid_2weekends)
-                    obj_bool_vars.append(trans_avoid_2weekends_var)
-                    obj_bool_coeffs.append(cost)
-                    
-                    
-        #max 2 weekends per month
-            weekends_in_month[e] = model.NewIntVar(0, 2,  'weekends_in_month[%i]' % e )
-            model.Add(weekends_in_month[e] == sum(weekenddays_worked[e, w] for w in range(number_of_weeks) )-1)
-            penalty = 2
-            obj_int_vars.append(weekends_in_month[e])
-            obj_int_coeffs.append(penalty)
-            total_weekends[e] = model.NewIntVar(0, number_of_weeks+8,  'total_weekends[%i]' % e )    
-            model.Add(total_weekends[e] == ansatte_number_of_weekends_worked_8weeks[ansatte[e]][0]+sum(weekenddays_worked[e, w] for w in range(number_of_weeks) ))
-           # model.Add(total_weekends[e] == sum(weekenddays_worked[e, w] for w in range(number_of_weeks) ))
-    
-    #equalize number of weekends with work over 12 weeks (current+8 before current month)    
-        min_fair_weekends_12weeks = model.NewIntVar(0, number_of_weeks+8, 'min_fair_shift__12weeks_%i' % e)
-        max_fair_weekends_12weeks = model.NewIntVar(0, number_of_weeks+8, 'max_fair_shift__12weeks_%i' % e)
-        model.AddMinEquality(min_fair_weekends_12weeks, [total_weekends[e] for e in range(num_employees)])        
-        model.AddMaxEquality(max_fair_weekends_12weeks, [total_weekends[e] for e in range(num_employees)])
-        weekends_diff_12weeks = model.NewIntVar(0, number_of_weeks+8, '')
-        model.Add(weekends_diff_12weeks==max_fair_weekends_12weeks - min_fair_weekends_12weeks)
-        penalty = 4
-        obj_int_vars.append(weekends_diff_12weeks)
+    #max 2 weekends per month
+        weekends_in_month[e] = model.NewIntVar(0, 2,  'weekends_in_month[%i]' % e )
+        model.Add(weekends_in_month[e] == sum(weekenddays_worked[e, w] for w in range(number_of_weeks) )-1)
+        penalty = 2
+        obj_int_vars.append(weekends_in_month[e])
         obj_int_coeffs.append(penalty)
+        total_weekends[e] = model.NewIntVar(0, number_of_weeks+8,  'total_weekends[%i]' % e )    
+        model.Add(total_weekends[e] == ansatte_number_of_weekends_worked_8weeks[ansatte[e]][0]+sum(weekenddays_worked[e, w] for w in range(number_of_weeks) ))
+       # model.Add(total_weekends[e] == sum(weekenddays_worked[e, w] for w in range(number_of_weeks) ))
+
+#equalize number of weekends with work over 12 weeks (current+8 before current month)    
+    min_fair_weekends_12weeks = model.NewIntVar(0, number_of_weeks+8, 'min_fair_shift__12weeks_%i' % e)
+    max_fair_weekends_12weeks = model.NewIntVar(0, number_of_weeks+8, 'max_fair_shift__12weeks_%i' % e)
+    model.AddMinEquality(min_fair_weekends_12weeks, [total_weekends[e] for e in range(num_employees)])        
+    model.AddMaxEquality(max_fair_weekends_12weeks, [total_weekends[e] for e in range(num_employees)])
+    weekends_diff_12weeks = model.NewIntVar(0, number_of_weeks+8, '')
+    model.Add(weekends_diff_12weeks==max_fair_weekends_12weeks - min_fair_weekends_12weeks)
+    penalty = 4
+    obj_int_vars.append(weekends_diff_12weeks)
+    obj_int_coeffs.append(penalty)
         
         
 
@@ -695,32 +902,32 @@ def solve_shift_scheduling(params, output_proto):
     sum_of_shifts = {}
     
     sum_of_equalfunctions = {}
-    sum_of_equalshifts = {}
     for e in range(num_employees):
 #nigt_shifts        
             sum_of_shifts[e] = model.NewIntVar(0, num_days, 'sum_of_shifts_%i' % e)
-            model.Add(sum_of_shifts[e] == sum(work[e, s, d] for s in night_shifts for d in range(offset, num_days)))
+            model.Add(sum_of_shifts[e] == cp_model.LinearExpr.Sum([work[e][s][d] for s in night_shifts for d in days_range]))
 #equalfunctions
             sum_of_equalfunctions[e] = model.NewIntVar(0, num_days, 'sum_of_equalfunctions_%i' % e)
-            model.Add(sum_of_equalfunctions[e] == sum(work[e, s, d] for s in equalfunctions for d in range(offset, num_days)))
+            model.Add(sum_of_equalfunctions[e] == cp_model.LinearExpr.Sum([work[e][s][d] for s in equalfunctions for d in days_range]))
             
 #night_shifts distrubuted equally across all nightshifts:
-    if 2>1:
-        sum_of_shifts_night = {}
-        for e in range(num_employees):
-            sum_of_shifts_night[e] = model.NewIntVar(0, num_days, 'sum_of_shifts_night_%i' % e)
-            model.Add(sum_of_shifts_night[e] == sum(work[e, s, d] for s in night_shifts for d in range(offset, num_days)))
-        
-        for s in night_shifts:
-            min_fair_shift_night = model.NewIntVar(0, num_days, 'min_fair_shift_night_%i' % s)
-            max_fair_shift_night = model.NewIntVar(0, num_days, 'max_fair_shift_night_%i' % s)
-            model.AddMinEquality(min_fair_shift_night, [sum_of_shifts_night[e] for e in range(num_employees)])
-            model.AddMaxEquality(max_fair_shift_night, [sum_of_shifts[e] for e in range(num_employees)]) 
-            nightshift_diff = model.NewIntVar(0, num_days, '')
-            model.Add(nightshift_diff==max_fair_shift_night - min_fair_shift_night)
-            penalty = 4
-            obj_int_vars.append(nightshift_diff)
-            obj_int_coeffs.append(penalty)
+    sum_of_shifts_night = {}
+    for e in range(num_employees):
+        sum_of_shifts_night[e] = model.NewIntVar(0, num_days, 'sum_of_shifts_night_%i' % e)
+        model.Add(sum_of_shifts_night[e] == cp_model.LinearExpr.Sum([work[e][s][d] for s in night_shifts for d in days_range]))
+    
+    # The spread was once posted per night shift with the same contents, so
+    # the single term keeps the weight of all those copies.
+    if night_shifts:
+        min_fair_shift_night = model.NewIntVar(0, num_days, 'min_fair_shift_night')
+        max_fair_shift_night = model.NewIntVar(0, num_days, 'max_fair_shift_night')
+        model.AddMinEquality(min_fair_shift_night, [sum_of_shifts_night[e] for e in range(num_employees)])
+        model.AddMaxEquality(max_fair_shift_night, [sum_of_shifts_night[e] for e in range(num_employees)])
+        nightshift_diff = model.NewIntVar(0, num_days, '')
+        model.Add(nightshift_diff==max_fair_shift_night - min_fair_shift_night)
+        penalty = 4 * len(night_shifts)
+        obj_int_vars.append(nightshift_diff)
+        obj_int_coeffs.append(penalty)
 
 #equalfunctions
 #    for s in equalfunctions:
@@ -735,16 +942,15 @@ def solve_shift_scheduling(params, output_proto):
 #       obj_int_coeffs.append(penalty)
 
 #equalfunctionsansatte
-    sum_of_equalshifts = {}
     for s, ansatte_in_shift in equalfunctionsansatte:
         for e in ansatte_in_shift:
            
-            sum_of_shifts[ansatte.index(e)] = model.NewIntVar(0, num_days, 'sum_of_shifts_%i' % ansatte.index(e))
-            model.Add(sum_of_shifts[ansatte.index(e)] == sum(work[ansatte.index(e), s, d] for d in range(offset, num_days)))
+            sum_of_shifts[employee_index[e]] = model.NewIntVar(0, num_days, 'sum_of_shifts_%i' % employee_index[e])
+            model.Add(sum_of_shifts[employee_index[e]] == cp_model.LinearExpr.Sum([work[employee_index[e]][s][d] for d in days_range]))
         min_fair_equalfunctions = model.NewIntVar(0, num_days, 'min_fair_equalfunctions_%i' % s)
         max_fair_equalfunctions = model.NewIntVar(0, num_days, 'max_fair_equalfunctions_%i' % s)
-        model.AddMinEquality(min_fair_equalfunctions, [sum_of_equalfunctions[ansatte.index(e)] for e in ansatte_in_shift])
-        model.AddMaxEquality(max_fair_equalfunctions, [sum_of_equalfunctions[ansatte.index(e)] for e in ansatte_in_shift]) 
+        model.AddMinEquality(min_fair_equalfunctions, [sum_of_equalfunctions[employee_index[e]] for e in ansatte_in_shift])
+        model.AddMaxEquality(max_fair_equalfunctions, [sum_of_equalfunctions[employee_index[e]] for e in ansatte_in_shift]) 
         equalfunctions_diff = model.NewIntVar(0, num_days, '')
         model.Add(equalfunctions_diff==max_fair_equalfunctions - min_fair_equalfunctions)
         penalty = 12
@@ -755,229 +961,108 @@ def solve_shift_scheduling(params, output_proto):
 
     
 #limit workhours     
+    # At most two shifts a day, so the two longest shifts bound a day's hours.
+    max_month_hours = len(days_range) * sum(sorted(durations)[-2:])
     month_end_hours = {
-        e: model.NewIntVar(int(normtid*0.01* ansat_arbejdstid[e][1]/37), int(normtid*1.2 * ansat_arbejdstid[e][1]/37), 'employee_%s_month_end_hours' % e)
+        e: model.NewIntVar(0, max_month_hours, 'employee_%s_month_end_hours' % e)
         for e in range(num_employees)
-         
      }
 
     for e in range(num_employees):
-        # this will be constrained because onth_end_hours is in domain [0, 24_800]
-        tmp = sum( work[e, s, d] * int(funktioner_varighed[str(s)]) for s in range(1, num_shifts) for d in range (offset, num_days) )   
-        model.Add(month_end_hours[e] == tmp)
+        model.Add(month_end_hours[e] == hours_worked[e])
+        model.AddLinearConstraint(month_end_hours[e],
+                                  int(normtid*0.01* ansat_arbejdstid[e][1]/37),
+                                  int(normtid*1.2 * ansat_arbejdstid[e][1]/37))
 
 
 
  
-# skills
-    for e, s, k in skills:
-        if k==0:
-            for d in range (offset, num_days): #avoid conflicts by skillschange with month change
-                if [e,s,d] not in fixed_assignments:#avoid fixed assignment conflicts
-                #print ('e',e,'s',s,'k',k, 'd', d) 
-                    model.Add(work[e, s, d] == 0)
-
 
 #enforce fkjt 2 efter fkt1
 #    for e in range(num_employees):
 #              for d in range(num_days-1):
-#                  model.Add(work[e, 2, d + 1] == 1 ).OnlyEnforceIf(work[e, 1, d])   
+#                  model.Add(work[e][2][d + 1] == 1 ).OnlyEnforceIf(work[e][1][d])   
 #enforce day shifts
 #    for e in range(num_employees):
 #        for w in range(num_weeks):
-#            model.Add(work[e, 2,  w*7+6] == 1 ).OnlyEnforceIf(work[e, 1, w*7+5])
+#            model.Add(work[e][2][w*7+6] == 1 ).OnlyEnforceIf(work[e][1][w*7+5])
             
 
 
-#fri hele weekenden                 
-    if 1>2:
-        for e in range(num_employees):
-            for w in range(num_weeks):
-                desired = [
-                            work[e, 0, 7*w+6].Not(), 
-                            work[e, 0, 7*w+5] 
-                                ]
-                desired_var = model.NewBoolVar(
-                        'whole weekend free (employee=%i, w=%i)' % (e, w))
-                desired.append(desired_var)
-                model.AddBoolOr(desired)
-                obj_bool_vars.append(desired_var)
-                obj_bool_coeffs.append(2)               
 
 
     #     for w in range(num_weeks):
-#             model.Add(work[e, 0, 7*w+6] == 1 ).OnlyEnforceIf(work[e, 0, 7*w+5])            
+#             model.Add(work[e][0][7*w+6] == 1 ).OnlyEnforceIf(work[e][0][7*w+5])            
 
-# favor desired_day_transistions
+# favor desired_day_transistions: cost 0 makes the transition mandatory,
+# otherwise working first_shift without second_shift that week costs cost.
     for first_shift, first_weekday, second_shift, second_weekday, cost in desired_day_transistions:
+        desired_vars = []
         for e in range(num_employees):
             for w in range(num_weeks):
-                desired = [
-                                work[e, first_shift, (7*w + first_weekday)].Not(), 
-                                work[e, second_shift, (7*w + second_weekday)] 
-                ]
-                #model.AddBoolOr(desired)
+                first = work[e][first_shift][(7*w + first_weekday)]
+                second = work[e][second_shift][(7*w + second_weekday)]
                 if cost == 0:
-                    #model.AddBoolOr(desired)
-                    model.Add(work[e, second_shift, (7*w + second_weekday)] == 1 ).OnlyEnforceIf(work[e, first_shift, (7*w + first_weekday)])
+                    model.Add(second == 1).OnlyEnforceIf(first)
                 else:
                     desired_var = model.NewBoolVar(
                             'desired_day_transition (employee=%i, day=%i, shift=%i w=%i)' % (e, 7*w + first_weekday, first_shift, cost))
-                    desired.append(desired_var)
-                    model.AddBoolOr(desired)
-                    obj_bool_vars.append(desired_var)
-                    obj_bool_coeffs.append(-1*cost)               
-
-# rewarded - desired_shift_transitions
-    #for previous_shift, next_shift, cost in rewarded_transitions:
+                    model.Add(desired_var >= first - second)
+                    desired_vars.append(desired_var)
+        obj_bool_vars.extend(desired_vars)
+        obj_bool_coeffs.extend([cost] * len(desired_vars))
+
+# desired_shift_transitions: cost 0 makes the transition mandatory, otherwise
+# working first_shift without next_shift next_day - first_day days later costs
+# cost. Transitions between the same two cells share one penalty variable.
+    shift_transition_costs = {}
     for first_shift, first_day, next_shift, next_day, cost in desired_shift_transitions:
         for e in range(num_employees):
             for d in range((num_days - next_day)):
-                transition_wanted = [
-                    work[e, first_shift, d+first_day].Not(), work[e, next_shift,
-                                                           d + next_day]
-                ]
-                
                 if cost == 0:
-                    #model.AddBoolOr(transition_wanted)
-                    model.Add(work[e, next_shift, d + next_day] == 1 ).OnlyEnforceIf(work[e, first_shift, d+first_day])
-                #if cost == 4:    
-                    #model.Add(work[e, next_shift, d + next_day] == 1 ).OnlyEnforceIf(work[e, first_shift, d+first_day])
-                    
-                    
+                    model.Add(work[e][next_shift][d + next_day] == 1 ).OnlyEnforceIf(work[e][first_shift][d+first_day])
                 else:
-                    trans_wanted_var = model.NewBoolVar(
-                        'desired_shift_transition (employee=%i, day=%i, firstshift=%i)' % (e, d, first_shift))
-                    transition_wanted.append(trans_wanted_var)
-                    model.AddBoolOr(transition_wanted)
-                    obj_bool_vars.append(trans_wanted_var)
-                    obj_bool_coeffs.append(-1*cost)
+                    key = (e, first_shift, d+first_day, next_shift, d+next_day)
+                    shift_transition_costs[key] = shift_transition_costs.get(key, 0) + cost
+    trans_wanted_vars = []
+    trans_wanted_coeffs = []
+    for (e, first_shift, first_d, next_shift, next_d), cost in shift_transition_costs.items():
+        trans_wanted_var = model.NewBoolVar(
+            'desired_shift_transition (employee=%i, day=%i, firstshift=%i, nextshift=%i)' % (e, first_d, first_shift, next_shift))
+        model.Add(trans_wanted_var >= work[e][first_shift][first_d] - work[e][next_shift][next_d])
+        trans_wanted_vars.append(trans_wanted_var)
+        trans_wanted_coeffs.append(cost)
+    obj_bool_vars.extend(trans_wanted_vars)
+    obj_bool_coeffs.extend(trans_wanted_coeffs)
     
-#only one weekend per month    
-    if 1>2:
-       
-            cost=4
-        
-            for week in range(num_weeks):
-                print('week',week)
-                print('break')
-                for w in range (week,num_weeks):
-                    if w>week:
-                        print ('w',w)
-                        for e in range(num_employees):
-                            #lør+søn
-                            for s in funktioner_vagt_index_sleep: 
-                            #+funktioner_vagt_dag_index_sleep:
-                                #print ('w',w)
-                                trans_wanted_sat=[work[e, s, week*7+5].Not(), work[e, 0,  w*7+5]]
-                                trans_wanted_sat2=[work[e, s, week*7+5].Not(), work[e, 0,  w*7+6]]
-                                trans_wanted_sun=[work[e, s, week*7+6].Not(), work[e, 0, w*7+6]]
-                                trans_wanted_sun2=[work[e, s, week*7+6].Not(), work[e, 0, w*7+5]]
-                                trans_wanted_sat_var=model.NewBoolVar('desired_shift_transition_week__weekend_sat (employee=%i, week=%i, weekend=%i firstshift=%i)' % (e, week, w, s))
-                                trans_wanted_sat2_var=model.NewBoolVar('desired_shift_transition_week__weekend_sat2 (employee=%i, week=%i, weekend=%i firstshift=%i)' % (e, week, w, s))
-                                trans_wanted_sun_var=model.NewBoolVar('desired_shift_transition_week__weekend_sun (employee=%i, week=%i, weekend=%i firstshift=%i)' % (e, week, w, s))
-                                trans_wanted_sun2_var=model.NewBoolVar('desired_shift_transition_week__weekend_sun2 (employee=%i, week=%i, weekend=%i firstshift=%i)' % (e, week, w, s))    
-                                trans_wanted_sat.append(trans_wanted_sat_var)
-                                trans_wanted_sat2.append(trans_wanted_sat2_var)
-                                trans_wanted_sun.append(trans_wanted_sun_var)
-                                trans_wanted_sun2.append(trans_wanted_sun2_var)
-                                model.AddBoolOr(trans_wanted_sat)
-                                model.AddBoolOr(trans_wanted_sat2)
-                                model.AddBoolOr(trans_wanted_sun)
-                                model.AddBoolOr(trans_wanted_sun2)
-                                obj_bool_vars.append(trans_wanted_sat_var)
-                                obj_bool_coeffs.append(cost)
-                                obj_bool_vars.append(trans_wanted_sat2_var)
-                                obj_bool_coeffs.append(cost)
-                                obj_bool_vars.append(trans_wanted_sun_var)
-                                obj_bool_coeffs.append(cost)
-                                obj_bool_vars.append(trans_wanted_sun2_var)
-                                obj_bool_coeffs.append(cost)
-                            #fredag nat    
-                            for s in night_shifts:
-                                cost=4
-                                trans_wanted_fri=[work[e, s, week*7+4].Not(), work[e, 0,  w*7+4]]
-                                trans_wanted_fri_var=model.NewBoolVar('desired_shift_transition_week_fri (employee=%i, week=%i, weekend=%i firstshift=%i)' % (e,week, w, s))
-                                trans_wanted_fri.append(trans_wanted_fri_var)     
-                                model.AddBoolOr(trans_wanted_fri)
-                                obj_bool_vars.append(trans_wanted_fri_var)
-                                obj_bool_coeffs.append(cost)
-                                trans_wanted_fri2=[work[e, s, week*7+4].Not(), work[e, 0,  w*7+5]]
-                                trans_wanted_fri2_var=model.NewBoolVar('desired_shift_transition_week_fri2 (employee=%i, week=%i, weekend=%i firstshift=%i)' % (e,week, w, s))
-                                trans_wanted_fri2.append(trans_wanted_fri2_var)     
-                                model.AddBoolOr(trans_wanted_fri2)
-                                obj_bool_vars.append(trans_wanted_fri2_var)
-                                obj_bool_coeffs.append(cost)
-                                trans_wanted_fri3=[work[e, s, week*7+4].Not(), work[e, 0,  w*7+6]]
-                                trans_wanted_fri3_var=model.NewBoolVar('desired_shift_transition_week_fri3 (employee=%i, week=%i, weekend=%i firstshift=%i)' % (e,week, w, s))
-                                trans_wanted_fri3.append(trans_wanted_fri3_var)     
-                                model.AddBoolOr(trans_wanted_fri3)
-                                obj_bool_vars.append(trans_wanted_fri3_var)
-                                obj_bool_coeffs.append(cost)
                     
 
 #avoid 2 consecutive weekends
-    if 1<2:
-        for e in range(num_employees):
-            for w in range(num_weeks-2):
-                #sat+sun
-                for s in funktioner_vagt_index_sleep: 
-                #+funktioner_vagt_dag_index_sleep:
-                    cost=8
-                    trans_wanted_sat=[work[e, s, w*7+5].Not(), work[e, 0,  w*7+12]]
-                    trans_wanted_sat_var=model.NewBoolVar('desired_shift_transition_week_sat (employee=%i, week=%i, firstshift=%i)' % (e, w, s))
-                    trans_wanted_sat.append(trans_wanted_sat_var)     
-                    model.AddBoolOr(trans_wanted_sat)
-                    obj_bool_vars.append(trans_wanted_sat_var)
-                    obj_bool_coeffs.append(cost)
-                    trans_wanted_sun=[work[e, s, w*7+6].Not(), work[e, 0, w*7+13]]
-                    trans_wanted_sun_var=model.NewBoolVar('desired_shift_transition_week_sun (employee=%i, week=%i, firstshift=%i)' % (e, w, s))
-                    trans_wanted_sun.append(trans_wanted_sun_var)     
-                    model.AddBoolOr(trans_wanted_sun)
-                    obj_bool_vars.append(trans_wanted_sun_var)
-                    obj_bool_coeffs.append(cost)
-        
-                    trans_wanted_sat2=[work[e, s, w*7+5].Not(), work[e, 0,  w*7+13]]
-                    trans_wanted_sat2_var=model.NewBoolVar('desired_shift_transition_week_sat2 (employee=%i, week=%i, firstshift=%i)' % (e, w, s))
-                    trans_wanted_sat2.append(trans_wanted_sat2_var)     
-                    model.AddBoolOr(trans_wanted_sat2)
-                    obj_bool_vars.append(trans_wanted_sat2_var)
-                    obj_bool_coeffs.append(cost)
-                    trans_wanted_sun2=[work[e, s, w*7+6].Not(), work[e, 0, w*7+12]]
-                    trans_wanted_sun2_var=model.NewBoolVar('desired_shift_transition_week_sun2 (employee=%i, week=%i, firstshift=%i)' % (e, w, s))
-                    trans_wanted_sun2.append(trans_wanted_sun2_var)     
-                    model.AddBoolOr(trans_wanted_sun2)
-                    obj_bool_vars.append(trans_wanted_sun2_var)
-                    obj_bool_coeffs.append(cost)
-                #friday lateshifts
-                for s in night_shifts:
-                    cost=8
-                    trans_wanted_fri=[work[e, s, w*7+4].Not(), work[e, 0,  w*7+11]]
-                    trans_wanted_fri_var=model.NewBoolVar('desired_shift_transition_week_fri (employee=%i, week=%i, firstshift=%i)' % (e, w, s))
-                    trans_wanted_fri.append(trans_wanted_fri_var)     
-                    model.AddBoolOr(trans_wanted_fri)
-                    obj_bool_vars.append(trans_wanted_fri_var)
-                    obj_bool_coeffs.append(cost)
-                    trans_wanted_fri2=[work[e, s, w*7+4].Not(), work[e, 0, w*7+12]]
-                    trans_wanted_fri2_var=model.NewBoolVar('desired_shift_transition_week_fri2 (employee=%i, week=%i, firstshift=%i)' % (e, w, s))
-                    trans_wanted_fri2.append(trans_wanted_fri2_var)     
-                    model.AddBoolOr(trans_wanted_fri2)
-                    obj_bool_vars.append(trans_wanted_fri2_var)
-                    obj_bool_coeffs.append(cost)
-                    
-                    trans_wanted_fri3=[work[e, s, w*7+4].Not(), work[e, 0, w*7+13]]
-                    trans_wanted_fri3_var=model.NewBoolVar('desired_shift_transition_week_fri3 (employee=%i, week=%i, firstshift=%i)' % (e, w, s))
-                    trans_wanted_fri3.append(trans_wanted_fri3_var)     
-                    model.AddBoolOr(trans_wanted_fri3)
-                    obj_bool_vars.append(trans_wanted_fri3_var)
-                    obj_bool_coeffs.append(cost)
-        
-                    
+# weekend_worked[e, w]: a sleep shift on saturday or sunday, or a friday night
+# shift, in week w. Each pair of such weekends in a row costs one penalty.
+    cost=8
+    weekend_worked = {}
+    for e in range(num_employees):
+        for w in range(num_weeks-1):
+            weekend_worked[e, w] = model.NewBoolVar('weekend_worked[%i,%i]' % (e, w))
+            model.AddMaxEquality(weekend_worked[e, w],
+                                 [work[e][s][w*7+day] for s in funktioner_vagt_index_sleep for day in (5, 6)]
+                                 + [work[e][s][w*7+4] for s in night_shifts])
+    weekend_vars = []
+    for e in range(num_employees):
+        for w in range(num_weeks-2):
+            trans_wanted_var=model.NewBoolVar('consecutive_weekends (employee=%i, week=%i)' % (e, w))
+            model.Add(trans_wanted_var >= weekend_worked[e, w] + weekend_worked[e, w+1] - 1)
+            weekend_vars.append(trans_wanted_var)
+    obj_bool_vars.extend(weekend_vars)
+    obj_bool_coeffs.extend([cost] * len(weekend_vars))
+
+
 # Shift constraints
     for ct in shift_constraints:
         shift, hard_min, soft_min, min_cost, soft_max, hard_max, max_cost = ct
         for e in range(num_employees):
-            works = [work[e, shift, d] for d in range(num_days)]
+            works = [work[e][shift][d] for d in range(num_days)]
             variables, coeffs = add_soft_sequence_constraint(
                 model, works, hard_min, soft_min, min_cost, soft_max, hard_max,
                 max_cost, 'shift_constraint(employee %i, shift %i)' % (e,
@@ -985,13 +1070,41 @@ def solve_shift_scheduling(params, output_proto):
             obj_bool_vars.extend(variables)
             obj_bool_coeffs.extend(coeffs)
 
+# Symmetry breaking: employees with the same equalfunctionsansatte groups, fixed
+# assignments, requests, skills, working time and weekend history are
+# interchangeable, so their schedules are ordered lexicographically.
+    employee_data = collections.defaultdict(list)
+    for e, s, d in fixed_assignments:
+        if d>(offset-1):
+            employee_data[e].append(('fixed', s, d))
+    for e, s, d, w in requests:
+        if d>(offset-1):
+            employee_data[e].append(('request', s, d, w))
+    for e, s, k in skills:
+        if k==0:
+            employee_data[e].append(('skill', s))
+    for s, ansatte_in_shift in equalfunctionsansatte:
+        for a in ansatte_in_shift:
+            employee_data[employee_index[a]].append(('equal', s))
+    equal_employees = collections.defaultdict(list)
+    for e in range(num_employees):
+        signature = (tuple(sorted(employee_data[e])), ansat_arbejdstid[e][1],
+                     ansatte_number_of_weekends_worked_8weeks[ansatte[e]][0])
+        equal_employees[signature].append(e)
+    for group in equal_employees.values():
+        for e1, e2 in zip(group, group[1:]):
+            add_lex_less_or_equal(
+                model,
+                [work[e1][s][d] for d in range(num_days) for s in range(num_shifts)],
+                [work[e2][s][d] for d in range(num_days) for s in range(num_shifts)])
+
  #evenly distribution
 #    max_days_per_e = num_days #((num_days//7)*2)-5 
 #    min_days_per_e = 0 #5 #num_days-((num_days//7)*2)    #num_days
     
     #print ('num_days', num_days,'min', min_days_per_e, 'max', max_days_per_e, 'n e', num_employees )
 #    for e in range(num_employees):
-#        num_days_worked = sum(work[e, s, d] for s in range(1, num_shifts) for d in range(num_days))#- shift 0 off
+#        num_days_worked = sum(work[e][s][d] for s in range(1, num_shifts) for d in range(num_days))#- shift 0 off
 #        model.Add(min_days_per_e <= num_days_worked)
 #        model.Add(num_days_worked <= max_days_per_e)
 #        #print (num_days_worked)
@@ -1002,126 +1115,162 @@ def solve_shift_scheduling(params, output_proto):
 
 # Objective
     model.Minimize(
-        sum(obj_bool_vars[i] * obj_bool_coeffs[i]
-            for i in range(len(obj_bool_vars)))
-        + sum(obj_int_vars[i] * obj_int_coeffs[i]
-              for i in range(len(obj_int_vars))))
+        cp_model.LinearExpr.WeightedSum(
+            obj_bool_vars + obj_int_vars + obj_linear_exprs,
+            obj_bool_coeffs + obj_int_coeffs + obj_linear_coeffs))
        
 
 
     if output_proto:
-        print('Writing proto to %s' % output_proto)
-        with open(output_proto, 'w') as text_file:
-            text_file.write(str(model))
+        log.info('Writing proto to %s', output_proto)
+        # Text format for a .txt suffix, binary otherwise.
+        model.ExportToFile(output_proto)
 
     # Solve the model.
     
     solver = cp_model.CpSolver()
     solver.parameters.max_time_in_seconds = calc_time
-    solver.parameters.num_search_workers = 8 
+    # CP-SAT's portfolio (LNS plus SAT/LP workers) scales up to about 16 workers.
+    solver.parameters.num_search_workers = min(16, os.cpu_count() or 8)
+    # The objective is mostly weighted sums of penalties, where the full LP
+    # relaxation gives much better bounds; --params can still override it.
+    solver.parameters.linearization_level = 2
+    if log.isEnabledFor(logging.DEBUG):
+        solver.parameters.log_search_progress = True
+        solver.parameters.log_to_stdout = False
+        solver.log_callback = log.debug
     if params:
-        text_format.Merge(params, solver.parameters)
-    solution_printer = cp_model.ObjectiveSolutionPrinter()
-    status = solver.SolveWithSolutionCallback(model, solution_printer)
+        # Newer ortools expose the parameters as a native object rather than
+        # a protobuf message.
+        if hasattr(solver.parameters, 'merge_text_format'):
+            solver.parameters.merge_text_format(params)
+        else:
+            text_format.Merge(params, solver.parameters)
+    solution_printer = ObjectiveSolutionLogger(
+        progress, solver.parameters.max_time_in_seconds)
+    if progress is not None:
+        progress({'status': 'running', 'pct': 0})
+    status = solver.Solve(model, solution_printer)
 
     # Print solution.
     if status == cp_model.OPTIMAL or status == cp_model.FEASIBLE:
-        if 2>1:
-            print()
-            a=''
-            for e in range(num_employees):
-                for w in range(number_of_weeks):
-                    #b=solver.Value(weekends[e, w])
-                    y=solver.Value(weekenddays_worked_int[e, w])
-                    p=solver.BooleanValue(weekenddays_worked[e, w])
-                    a+='e%i_w%i_weekdays%i_bool%i' %(e,w,y,p) + '\n'
-                    
-                z=solver.Value(total_weekends[e]) 
-                a+='empl %s total weekends %i' %(ansatte[e],z)+ '\n'
-            print(a)
-        print()
-        header = '  '
-        for w in range(num_weeks):
-            header += '  M    T    W    T    F    S    S   '
-        print(header)
-        for e in range(num_employees_dummy):
-            schedule = ''
-            for d in range(offset, num_days):
-                for s in range(num_shifts):
-                    if solver.BooleanValue(work[e, s, d]):
-                        schedule += shifts[s] + ' '
-            ny_e =  "{0:0>2}".format(e)
-          #  print(employees[e])  
-           # print('worker:',ny_e, '%s' % (schedule))
-            print(employees_dummy[e]+':', '%s' % (schedule))
-
-        print()
-        allskema=""
+        # Read every work literal from the response in one pass instead of a
+        # BooleanValue call per (e, s, d).
+        values = list(solver.ResponseProto().solution)
+        assigned = [[[values[var.Index()] for var in days] for days in shifts_e]
+                    for shifts_e in work]
+        log.info('')
+        lines = []
+        for e in range(num_employees):
+            for w in range(number_of_weeks):
+                y=sum(solver.BooleanValue(v) for v in weekend_work[e, w])
+                p=solver.BooleanValue(weekenddays_worked[e, w])
+                lines.append('e%i_w%i_weekdays%i_bool%i\n' %(e,w,y,p))
+            z=solver.Value(total_weekends[e]) 
+            lines.append('empl %s total weekends %i\n' %(ansatte[e],z))
+        log.info('%s', ''.join(lines))
+        log.info('')
+        log.info('%s', '  ' + '  M    T    W    T    F    S    S   ' * num_weeks)
+        for e in range(num_employees):
+            schedule = ''.join(shifts[s] + ' '
+                               for d in days_range for s in range(num_shifts)
+                               if assigned[e][s][d])
+            log.info('%s: %s', employees[e], schedule)
+        schedule = ''.join((shifts[s] + ' ') * solver.Value(unfilled[s, d])
+                           for d in days_range for s in range(1, num_shifts))
+        log.info('?: %s', schedule)
+
+        log.info('')
+        day_lines = []
         for d in range(num_days):
-            day = d
-            date = dates[d]
-            ugedag = ugedag_dag[d]
-            skema = '{'+ f'day : {day} '+f'-{ugedag}'+f' ({date}) :'
-            fri = ', fri : "'
+            skema = ['{day : %s -%s (%s) :' % (d, ugedag_dag[d], dates[d])]
+            fri = []
             for s in range(num_shifts): 
-                for e in range(num_employees_dummy):
-                    if solver.BooleanValue(work[e, s, d]):
-                        if shifts[s] != "Sove":
-                            skema += shifts[s] + ':' +  employees_dummy[e]+','
-                        if  shifts[s] == "Sove":
-                            fri += employees_dummy[e] + ','
-            skema +=  '"'+fri[:-1]+'"'+'}'       
-            allskema += skema + '\n'           
-            print(skema)
-        print()
-        data={}
+                for e in range(num_employees):
+                    if assigned[e][s][d]:
+                        if shifts[s] == "Sove":
+                            fri.append(employees[e])
+                        else:
+                            skema.append(shifts[s] + ':' + employees[e] + ',')
+                if s > 0:
+                    skema.append((shifts[s] + ':?,') * solver.Value(unfilled[s, d]))
+            if fri:
+                skema.append('", fri : "' + ','.join(fri) + '"}')
+            else:
+                skema.append('", fri : "}')
+            day_lines.append(''.join(skema))
+            log.info('%s', day_lines[-1])
+        allskema = ''.join(line + '\n' for line in day_lines)
+        log.info('')
+        result={}
         for s in range(num_shifts):
-            data[shifts[s]]=[]
+            result[shifts[s]]=[]
             for d in range(num_days):
-                ansatte =''
-                for e in range(num_employees_dummy):
-                    if solver.BooleanValue(work[e, s, d]):
-                        ansatte += employees_dummy[e]+" "
-                        #data[shifts[s]].append({dates[d]:employees[e]})
-                data[shifts[s]].append({dates[d]:ansatte.rstrip()})
-        import json
-        with open('brain.json', 'w') as outfile:
-            json.dump(data, outfile)                
+                names = [employees[e] for e in range(num_employees)
+                         if assigned[e][s][d]]
+                if s > 0:
+                    names += ['?'] * solver.Value(unfilled[s, d])
+                result[shifts[s]].append({dates[d]: ' '.join(names)})
                         
         
-        print(data)
+        log.info('%s', result)
                     
         
         
             
             
-        outF = open("OutFile.txt", "w")
-        outF.write(allskema)
-        outF.close()
+        PERSIST.submit(write_text, output_path('OutFile'), allskema)
             
-        print()
-        print('Penalties:')
+        log.info('')
+        log.info('Penalties:')
         for i, var in enumerate(obj_bool_vars):
             if solver.BooleanValue(var):
                 penalty = obj_bool_coeffs[i]
                 if penalty > 0:
-                    print('  %s violated, penalty=%i' % (var.Name(), penalty))
+                    log.info('  %s violated, penalty=%i', var.Name(), penalty)
                 else:
-                    print('  %s fulfilled, gain=%i' % (var.Name(), -penalty))
+                    log.info('  %s fulfilled, gain=%i', var.Name(), -penalty)
 
         for i, var in enumerate(obj_int_vars):
             if solver.Value(var) > 0:
-                print('  %s violated by %i, linear penalty=%i' %
-                      (var.Name(), solver.Value(var), obj_int_coeffs[i]))
+                log.info('  %s violated by %i, linear penalty=%i', var.Name(), solver.Value(var), obj_int_coeffs[i])
+
+        log.info('')
+        log.info('Hours worked:')
+        for e in range(num_employees):
+            log.info('  %s: %i', employees[e], solver.Value(hours_worked[e]))
                 
-    print()
+    log.info('')
     
-    print(solver.ResponseStats())
+    log.info('%s', solver.ResponseStats())
     #print(obj_bool_vars) 
+    if status == cp_model.OPTIMAL or status == cp_model.FEASIBLE:
+        return result
+    return {}
+
+
+def run(data, params='', output_proto='', hint=None, progress=None):
+    """Solves data with the solver log written to brainsolution.txt."""
+    handler = logging.FileHandler(output_path('brainsolution'), 'w')
+    handler.setFormatter(logging.Formatter('%(message)s'))
+    log.addHandler(handler)
+    try:
+        return solve_shift_scheduling(data, params, output_proto, hint, progress)
+    finally:
+        log.removeHandler(handler)
+        handler.close()
+
 
 def main(args):
     """Main."""
-    solve_shift_scheduling(args.params, args.output_proto)
+    if args.verbose:
+        log.setLevel(logging.DEBUG)
+    data = orjson.loads((ROOT / 'data.json').read_bytes())
+    hint = None
+    if args.warm_start and (ROOT / 'brain.json').exists():
+        hint = orjson.loads((ROOT / 'brain.json').read_bytes())
+    result = run(data, args.params, args.output_proto, hint)
+    (ROOT / 'brain.json').write_bytes(orjson.dumps(result))
 
 
 if __name__ == '__main__':
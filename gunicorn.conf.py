@@ -0,0 +1,13 @@
+# Gunicorn reads this file from the working directory, so App Service's
+# default `gunicorn app:app` startup picks it up without extra flags.
+
+# One process with a thread pool: a /json request waiting on a solve holds a
+# single thread, and the /json/jobs table stays visible to /progress.
+# gevent is not used because its monkey-patching does not mix with the
+# solver's ProcessPoolExecutor.
+workers = 1
+worker_class = 'gthread'
+threads = 16
+
+# Synchronous /json calls wait for the whole solve (calc_time seconds).
+timeout = 600